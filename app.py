@@ -1,11 +1,21 @@
 import io
 import re
 from datetime import datetime, date
-from typing import List, Set, Tuple
+from typing import FrozenSet, List, Set, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
-from openpyxl.styles import Font
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+
+try:
+    import python_calamine  # noqa: F401  (lector .xlsx en Rust, pandas >= 2.2)
+    XLSX_ENGINE = "calamine"
+except ImportError:
+    XLSX_ENGINE = "openpyxl"  # pandas ya lo abre en modo read_only
 
 # ----------------------------
 # Config
@@ -13,6 +23,21 @@ from openpyxl.styles import Font
 st.set_page_config(page_title="Reporte Domingos y Feriados", layout="wide")
 
 INVALID_TURNOS = {"L", ""}  # "L" y vacío NO cuentan como trabajado. Todo lo demás sí.
+NS_PER_DAY = 86_400_000_000_000
+TOTAL_COLS = [
+    "Domingos trabajados",
+    "Festivos trabajados",
+    "Total (D + F)",
+    "Fechas (domingos)",
+    "Fechas (festivos)",
+    "Fechas (todas)",
+]
+HOLIDAY_SEP_RE = re.compile(r"[,\n;]+")  # separadores de la lista de feriados manuales
+
+# Mismo estilo de encabezado que usa pandas en DataFrame.to_excel
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(*(Side(style="thin"),) * 4)
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="top")
 
 # ----------------------------
 # Helpers
@@ -39,33 +64,52 @@ def is_turno_valido(turno: str) -> bool:
     return t not in INVALID_TURNOS
 
 
+def turnos_trabajados(turnos: pd.Series) -> np.ndarray:
+    """Versión vectorizada de is_turno_valido sobre una columna completa de turnos."""
+    t = turnos.astype("string").str.strip()
+    trabajado = t.notna() & ~t.str.lower().isin(["nan", "none"]) & ~t.isin(list(INVALID_TURNOS))
+    return trabajado.to_numpy(dtype=bool, na_value=False)
+
+
 def detect_date_columns(df: pd.DataFrame, meta_cols: List[str]) -> List:
     """
     Detecta columnas de fecha del reporte.
     Maneja encabezados que vienen como datetime real o como string 'dd-mm-yyyy'.
     """
-    date_cols = []
-    for c in df.columns:
-        if c in meta_cols:
-            continue
-        
-        # Caso 1: Excel ya lo leyó como objeto fecha/timestamp
-        if isinstance(c, (pd.Timestamp, datetime, date)):
-            date_cols.append(c)
-            continue
-        
-        # Caso 2: Viene como string "01-02-2026"
-        if isinstance(c, str):
-            c2 = c.strip()
-            try:
-                # IMPORTANTE: dayfirst=True para formato Latino (dd-mm-yyyy)
-                _ = pd.to_datetime(c2, errors="raise", dayfirst=True)
-                date_cols.append(c)
-            except Exception:
-                pass
+    # Caso 1: Excel ya lo leyó como objeto fecha/timestamp
+    # Caso 2: Viene como string "01-02-2026" -> se parsean todos juntos en una llamada
+    # IMPORTANTE: dayfirst=True para formato Latino (dd-mm-yyyy)
+    cands = [c for c in df.columns if c not in meta_cols and isinstance(c, str)]
+    parsed = pd.to_datetime(
+        pd.Series([c.strip() for c in cands], dtype=object), errors="coerce", dayfirst=True, format="mixed"
+    )
+    str_dates = {c for c, ts in zip(cands, parsed) if pd.notna(ts)}
+
+    date_cols = [
+        c for c in df.columns
+        if c not in meta_cols and (isinstance(c, (pd.Timestamp, datetime, date)) or c in str_dates)
+    ]
     return date_cols
 
 
+def parse_header_date(c) -> pd.Timestamp:
+    """Convierte un encabezado de columna (fecha real o 'dd-mm-yyyy') a Timestamp. NaT si no es fecha."""
+    if not isinstance(c, (pd.Timestamp, datetime, date)):
+        c = str(c).strip()
+    ts = pd.to_datetime(c, errors="coerce", dayfirst=True)
+    return pd.NaT if pd.isna(ts) else ts.normalize()
+
+
+def classify_days(days: np.ndarray, hol_days: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Marca domingos y feriados sobre fechas expresadas como días desde 1970-01-01.
+    Retorna (es_domingo, es_festivo) como arrays booleanos.
+    """
+    es_domingo = (days + 3) % 7 == 6  # 1970-01-01 fue jueves (weekday 3)
+    es_festivo = np.isin(days, hol_days)
+    return es_domingo, es_festivo
+
+
 def parse_holidays(text: str) -> Set[pd.Timestamp]:
     """
     Acepta fechas manuales separadas por coma o salto de línea.
@@ -73,147 +117,193 @@ def parse_holidays(text: str) -> Set[pd.Timestamp]:
     if not text or not text.strip():
         return set()
 
-    parts = re.split(r"[,\n;]+", text.strip())
-    holidays = set()
+    parts = [p.strip() for p in HOLIDAY_SEP_RE.split(text.strip()) if p.strip()]
+    norm = pd.Series([p.replace(".", "-").replace("/", "-") for p in parts], dtype=object)
 
-    for p in parts:
-        p = p.strip()
-        if not p:
-            continue
+    # Un solo parseo para todas las fechas (dayfirst=True para Chile/Latam);
+    # format="mixed" mantiene la interpretación independiente de cada fecha
+    dt_vals = pd.to_datetime(norm, errors="coerce", dayfirst=True, format="mixed")
 
-        p_norm = p.replace(".", "-").replace("/", "-")
+    retry = dt_vals.isna()
+    if retry.any():
+        dt_vals[retry] = pd.to_datetime(norm[retry], errors="coerce", dayfirst=False, format="mixed")
 
-        # Intento con dayfirst=True (Chile/Latam)
-        dt_val = pd.to_datetime(p_norm, errors="coerce", dayfirst=True)
-        
-        if pd.isna(dt_val):
-            dt_val = pd.to_datetime(p_norm, errors="coerce", dayfirst=False)
+    for p in np.array(parts, dtype=object)[dt_vals.isna().to_numpy()]:
+        st.warning(f"⚠️ No se pudo interpretar la fecha de feriado manual: '{p}'. Se omitirá.")
 
-        if pd.isna(dt_val):
-            st.warning(f"⚠️ No se pudo interpretar la fecha de feriado manual: '{p}'. Se omitirá.")
-            continue
+    holidays = set(dt_vals.dropna().dt.normalize())
+    return holidays
 
-        holidays.add(pd.Timestamp(dt_val.date()))
 
-    return holidays
+@st.cache_data(show_spinner=False)
+def load_sheet_names(data: bytes, engine: str) -> List[str]:
+    """Lista las hojas del archivo (cacheado por contenido del archivo)."""
+    return pd.ExcelFile(io.BytesIO(data), engine=engine).sheet_names
 
 
+@st.cache_data(show_spinner=False)
+def load_excel(data: bytes, sheet_name: str, engine: str) -> pd.DataFrame:
+    """Lee la hoja seleccionada (cacheado para no re-parsear en cada rerun)."""
+    return pd.read_excel(io.BytesIO(data), sheet_name=sheet_name, engine=engine)
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
 def build_summary(
     df: pd.DataFrame,
     meta_cols: List[str],
     date_cols: List,
-    holidays: Set[pd.Timestamp],
+    holidays: FrozenSet[pd.Timestamp],
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, str]:
-    """Procesa la data para generar los reportes."""
+    """Procesa la data para generar los reportes (cacheado entre reruns)."""
     if not date_cols:
         raise ValueError("No se detectaron columnas de fecha en el archivo. Verifica los encabezados.")
 
-    # Convertir de formato ancho a formato largo
-    dfl = df.melt(id_vars=meta_cols, value_vars=date_cols, var_name="Fecha_Header", value_name="Turno")
-    dfl["Turno_norm"] = dfl["Turno"].apply(_normalize_turno)
-    dfl["Trabajado"] = dfl["Turno_norm"].apply(is_turno_valido)
-
-    dfl["Fecha_dt"] = pd.to_datetime(dfl["Fecha_Header"], errors="coerce", dayfirst=True)
-    
-    if dfl["Fecha_dt"].isna().all():
+    # Parsear cada encabezado una sola vez (no una vez por colaborador)
+    col_to_ts = {c: parse_header_date(c) for c in date_cols}
+    if all(pd.isna(ts) for ts in col_to_ts.values()):
         raise ValueError("Error convirtiendo columnas a fecha. Revisa el formato de los encabezados.")
 
-    dfl["Fecha_dt"] = dfl["Fecha_dt"].dt.date
-    dfl["Fecha_ts"] = dfl["Fecha_dt"].apply(lambda x: pd.Timestamp(x))
+    col_ts = pd.DatetimeIndex(list(col_to_ts.values()))
+    # Fechas como datetime64[D]: sirven tanto para Fecha_dt como para la aritmética de días
+    col_dates = col_ts.values.astype("datetime64[D]")
+    periodo_str = f"{col_ts.min().strftime('%d-%m-%Y')} a {col_ts.max().strftime('%d-%m-%Y')}"
+
+    # Matriz colaborador x fecha (formato ancho): un solo pase sobre el bloque aplanado,
+    # sin materializar el melt ni repetir las columnas meta
+    block = df[date_cols].to_numpy(dtype=object)
+    worked = turnos_trabajados(pd.Series(block.reshape(-1))).reshape(block.shape) & ~np.isnat(col_dates)
 
-    start = min(dfl["Fecha_dt"])
-    end = max(dfl["Fecha_dt"])
-    periodo_str = f"{start.strftime('%d-%m-%Y')} a {end.strftime('%d-%m-%Y')}"
+    # Domingos y festivos se clasifican una vez por columna
+    days = col_dates.view("i8")
+    hol_days = np.array([h.value // NS_PER_DAY for h in holidays], dtype="i8")
+    es_domingo, es_festivo = classify_days(days, hol_days)
 
-    # Lógica Domingos (weekday == 6 es Domingo)
-    dfl["Es_domingo"] = pd.to_datetime(dfl["Fecha_dt"]).dt.weekday == 6
-    dom = dfl[(dfl["Trabajado"]) & (dfl["Es_domingo"])].copy()
+    def long_rows(mask: np.ndarray) -> pd.DataFrame:
+        """Formato largo (meta + Fecha_dt) solo para las celdas marcadas."""
+        rows, cols = np.nonzero(mask)
+        return df[meta_cols].iloc[rows].assign(Fecha_dt=col_dates[cols])
 
-    # Lógica Festivos
-    if holidays:
-        fest = dfl[(dfl["Trabajado"]) & (dfl["Fecha_ts"].isin(holidays))].copy()
-    else:
-        fest = dfl.iloc[0:0].copy()
+    dom = long_rows(worked & es_domingo)
+
+    # strftime una vez por fecha del periodo, no una vez por ocurrencia
+    fmt = {ts: ts.strftime("%d-%m-%Y") for ts in col_ts.dropna()}
+
+    def fmt_dates(dates) -> str:
+        return ", ".join(fmt[x] for x in sorted(dates))
+
+    base_users = df[meta_cols].drop_duplicates().reset_index(drop=True)
 
     def agg_table(sub: pd.DataFrame, label_count: str, label_dates: str) -> pd.DataFrame:
         if sub.empty:
-            base = df[meta_cols].drop_duplicates().copy()
-            base[label_count] = 0
-            base[label_dates] = ""
-            return base
+            return base_users.assign(**{label_count: 0, label_dates: ""})
 
+        # Deduplicar antes de agrupar: cada grupo ya trae fechas únicas
         grp = (
-            sub.groupby(meta_cols, dropna=False)["Fecha_dt"]
-            .apply(lambda s: sorted(set(s)))
+            sub.drop_duplicates(subset=[*meta_cols, "Fecha_dt"])
+            .groupby(meta_cols, dropna=False, observed=True)["Fecha_dt"]
+            .agg(list)
             .reset_index()
         )
-        grp[label_count] = grp["Fecha_dt"].apply(len)
-        grp[label_dates] = grp["Fecha_dt"].apply(lambda lst: ", ".join([pd.Timestamp(x).strftime("%d-%m-%Y") for x in lst]))
+        grp[label_count] = grp["Fecha_dt"].str.len()
+        grp[label_dates] = grp["Fecha_dt"].map(fmt_dates)
         grp = grp.drop(columns=["Fecha_dt"])
         return grp
 
     dom_tbl = agg_table(dom, "Domingos trabajados", "Fechas (domingos)")
+
+    # Sin feriados no hay nada que agrupar en festivos: el total son los domingos
+    if not holidays:
+        fest_tbl = base_users.assign(**{"Festivos trabajados": 0, "Fechas (festivos)": ""})
+        total = base_users.merge(dom_tbl, on=meta_cols, how="left")
+        total["Domingos trabajados"] = total["Domingos trabajados"].fillna(0).astype(int)
+        total["Fechas (domingos)"] = total["Fechas (domingos)"].fillna("")
+        total = total.assign(**{
+            "Festivos trabajados": 0,
+            "Total (D + F)": total["Domingos trabajados"],
+            "Fechas (festivos)": "",
+            "Fechas (todas)": total["Fechas (domingos)"],
+        })
+        return dom_tbl, fest_tbl, total[[*meta_cols, *TOTAL_COLS]], periodo_str
+
+    fest = long_rows(worked & es_festivo)
     fest_tbl = agg_table(fest, "Festivos trabajados", "Fechas (festivos)")
 
-    base_users = df[meta_cols].drop_duplicates().reset_index(drop=True)
-    
-    def make_lookup(sub_df):
-        if sub_df.empty: return {}
-        return sub_df.groupby(meta_cols, dropna=False)["Fecha_dt"].apply(set).to_dict()
-
-    dom_map = make_lookup(dom)
-    fest_map = make_lookup(fest)
-
-    total_rows = []
-    for _, row in base_users.iterrows():
-        key = tuple(row[c] for c in meta_cols)
-        s_dom = dom_map.get(key, set())
-        s_fest = fest_map.get(key, set())
-        s_all = s_dom | s_fest 
-
-        total_rows.append(
-            {
-                **{c: row[c] for c in meta_cols},
-                "Domingos trabajados": len(s_dom),
-                "Festivos trabajados": len(s_fest),
-                "Total (D + F)": len(s_all),
-                "Fechas (domingos)": ", ".join([x.strftime("%d-%m-%Y") for x in sorted(s_dom)]),
-                "Fechas (festivos)": ", ".join([x.strftime("%d-%m-%Y") for x in sorted(s_fest)]),
-                "Fechas (todas)": ", ".join([x.strftime("%d-%m-%Y") for x in sorted(s_all)]),
-            }
-        )
+    def date_sets(sub_df: pd.DataFrame, name: str) -> pd.DataFrame:
+        if sub_df.empty:
+            return pd.DataFrame(columns=[*meta_cols, name])
+        return sub_df.groupby(meta_cols, dropna=False, observed=True)["Fecha_dt"].agg(frozenset).rename(name).reset_index()
+
+    # Un único join por tipo de fecha; los colaboradores sin fechas quedan con NaN
+    total = base_users.merge(date_sets(dom, "s_dom"), on=meta_cols, how="left")
+    total = total.merge(date_sets(fest, "s_fest"), on=meta_cols, how="left")
 
-    return dom_tbl, fest_tbl, pd.DataFrame(total_rows), periodo_str
+    empty = frozenset()
+    s_dom = pd.Series([x if isinstance(x, frozenset) else empty for x in total.pop("s_dom")])
+    s_fest = pd.Series([x if isinstance(x, frozenset) else empty for x in total.pop("s_fest")])
+    s_all = pd.Series([a | b for a, b in zip(s_dom, s_fest)])
 
+    total["Domingos trabajados"] = s_dom.map(len)
+    total["Festivos trabajados"] = s_fest.map(len)
+    total["Total (D + F)"] = s_all.map(len)
+    total["Fechas (domingos)"] = s_dom.map(fmt_dates)
+    total["Fechas (festivos)"] = s_fest.map(fmt_dates)
+    total["Fechas (todas)"] = s_all.map(fmt_dates)
 
-def export_excel(dom_tbl, fest_tbl, total_tbl, periodo, holidays) -> bytes:
+    return dom_tbl, fest_tbl, total, periodo_str
+
+
+def export_excel(dom_tbl, fest_tbl, total_tbl, periodo, holidays) -> io.BytesIO:
     output = io.BytesIO()
     feriados_str = ", ".join(sorted([h.strftime("%d-%m-%Y") for h in holidays])) if holidays else "(ninguno)"
 
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        startrow = 4
-        sheets = {"Domingos": dom_tbl, "Festivos": fest_tbl, "Resumen Total": total_tbl}
-
-        for sheet_name, data in sheets.items():
-            data.to_excel(writer, index=False, sheet_name=sheet_name, startrow=startrow)
-            ws = writer.book[sheet_name]
-            
-            ws["A1"] = f"Reporte de Asistencias: {sheet_name}"
-            ws["A1"].font = Font(bold=True, size=12)
-            ws["A2"] = f"Periodo: {periodo}"
-            ws["A3"] = "Criterio: Se cuentan todos los turnos excepto 'L' y celdas vacías."
-            if sheet_name != "Domingos":
-                ws["A4"] = f"Feriados considerados: {feriados_str}"
-            
-            for col in ws.columns:
-                max_len = 0
-                col_letter = col[0].column_letter
-                for cell in col[:200]:
-                    val = "" if cell.value is None else str(cell.value)
-                    max_len = max(max_len, len(val))
-                ws.column_dimensions[col_letter].width = min(max(10, max_len + 2), 50)
-
-    return output.getvalue()
+    # Modo write-only: las filas se serializan a medida que se agregan
+    wb = Workbook(write_only=True)
+    sheets = {"Domingos": dom_tbl, "Festivos": fest_tbl, "Resumen Total": total_tbl}
+
+    for sheet_name, data in sheets.items():
+        ws = wb.create_sheet(sheet_name)
+
+        info = [
+            f"Reporte de Asistencias: {sheet_name}",
+            f"Periodo: {periodo}",
+            "Criterio: Se cuentan todos los turnos excepto 'L' y celdas vacías.",
+        ]
+        if sheet_name != "Domingos":
+            info.append(f"Feriados considerados: {feriados_str}")
+
+        # En write-only no se puede recorrer ws.columns: anchos desde el DataFrame
+        values = data.astype(object).where(data.notna(), None)
+        for i, col in enumerate(data.columns):
+            lens = data[col].dropna().astype(str).str.len()
+            max_len = max([len(str(col))] + ([int(lens.max())] if len(lens) else []))
+            if i == 0:
+                max_len = max([max_len] + [len(x) for x in info])
+            ws.column_dimensions[get_column_letter(i + 1)].width = min(max(10, max_len + 2), 50)
+
+        title = WriteOnlyCell(ws, value=info[0])
+        title.font = Font(bold=True, size=12)
+        ws.append([title])
+        for line in info[1:]:
+            ws.append([line])
+        if len(info) < 4:
+            ws.append([])
+
+        header = []
+        for col in data.columns:
+            cell = WriteOnlyCell(ws, value=str(col))
+            cell.font = HEADER_FONT
+            cell.border = HEADER_BORDER
+            cell.alignment = HEADER_ALIGNMENT
+            header.append(cell)
+        ws.append(header)
+
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+
+    wb.save(output)
+    # Se entrega el buffer (sin copiar con getvalue); download_button acepta file-likes
+    output.seek(0)
+    return output
 
 
 # ----------------------------
@@ -245,12 +335,12 @@ with col_f2:
 
 if uploaded:
     try:
-        engine = "openpyxl" if uploaded.name.endswith("xlsx") else "xlrd"
+        engine = XLSX_ENGINE if uploaded.name.endswith("xlsx") else "xlrd"
         
-        xls_file = pd.ExcelFile(uploaded, engine=engine)
-        sheet_name = st.selectbox("Selecciona la hoja con los datos:", xls_file.sheet_names)
+        file_bytes = uploaded.getvalue()
+        sheet_name = st.selectbox("Selecciona la hoja con los datos:", load_sheet_names(file_bytes, engine))
         
-        df = pd.read_excel(uploaded, sheet_name=sheet_name, engine=engine)
+        df = load_excel(file_bytes, sheet_name, engine)
 
         meta_cols = ["Nombre del Colaborador", "RUT", "Área", "Supervisor"]
         missing = [c for c in meta_cols if c not in df.columns]
@@ -259,11 +349,14 @@ if uploaded:
             st.warning("Asegúrate que el Excel tenga las columnas: Nombre del Colaborador, RUT, Área, Supervisor")
             st.stop()
 
+        # Categorías: el groupby por colaborador trabaja sobre códigos enteros
+        df[meta_cols] = df[meta_cols].astype("category")
+
         date_cols = detect_date_columns(df, meta_cols)
         holidays = parse_holidays(feriados_text)
         
         with st.spinner('Procesando turnos...'):
-            dom_tbl, fest_tbl, total_tbl, periodo_str = build_summary(df, meta_cols, date_cols, holidays)
+            dom_tbl, fest_tbl, total_tbl, periodo_str = build_summary(df, meta_cols, date_cols, frozenset(holidays))
 
         st.success(f"✅ Procesamiento exitoso. Periodo detectado: **{periodo_str}**")
 